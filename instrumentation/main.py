@@ -1,81 +1,61 @@
-import logging
+import asyncio
+import os
 import random
-import time
 
 import uvicorn
-from fastapi import FastAPI, Request
-from opentelemetry import metrics
-from opentelemetry._logs import set_logger_provider
-from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
-from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
-from opentelemetry.sdk._logs._internal.export import BatchLogRecordProcessor
-from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.sdk.metrics._internal.export import PeriodicExportingMetricReader
-from opentelemetry.sdk.resources import Resource, SERVICE_VERSION, SERVICE_NAME
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import (
-    BatchSpanProcessor,
-)
-from opentelemetry.trace import get_tracer_provider, set_tracer_provider
 
-resource = Resource(attributes={
-    SERVICE_NAME: "cf-o11y-instrumentor",
-    SERVICE_VERSION: "1.0-BETA"
-})
+from telemetry import export_uvicorn_errors, setup
 
-set_tracer_provider(TracerProvider(resource=resource))
-get_tracer_provider().add_span_processor(
-    BatchSpanProcessor(OTLPSpanExporter(endpoint="http://localhost:4318/v1/traces"))
-)
+setup("cf-o11y-instrumentor", "1.0-BETA", "CF-Service-auto")
 
-reader = PeriodicExportingMetricReader(OTLPMetricExporter(endpoint="http://localhost:4318/v1/metrics"))
-metricsProvider = MeterProvider(resource=resource, metric_readers=[reader])
-metrics.set_meter_provider(metricsProvider)
-
-
-logger_exporter = OTLPLogExporter(endpoint="http://localhost:4318/v1/logs")
-logger_provider = LoggerProvider(resource=resource)
-logger_provider.add_log_record_processor(BatchLogRecordProcessor(logger_exporter))
-
-handler = LoggingHandler(level=logging.NOTSET, logger_provider=logger_provider)
-logging.getLogger().addHandler(handler)
-
-set_logger_provider(logger_provider)
 instrumentor = FastAPIInstrumentor()
 
+app = FastAPI(default_response_class=ORJSONResponse)
+export_uvicorn_errors(app)
+
+# HTTP methods whose request body is echoed back by /server_request
+BODY_METHODS = frozenset(("POST", "PUT", "PATCH"))
 
-logger = logging.getLogger("CF-Service-auto")
+# Per-worker PRNG for the simulated /slow delay, bound once at import
+slow_delay = random.Random().uniform
 
-app = FastAPI()
+# Pre-serialised /health body, reused for every probe
+HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
 
-instrumentor.instrument_app(app, excluded_urls="/health", meter_provider=metricsProvider)
+instrumentor.instrument_app(app, excluded_urls="/health")
 
 @app.get("/health")
-def health_check():
-    return {"status": "ok"}
+async def health_check():
+    return HEALTH_RESPONSE
 
 @app.get("/slow")
-def slow_endpoint():
-    time.sleep(random.uniform(0.5, 2.0))
+async def slow_endpoint():
+    await asyncio.sleep(slow_delay(0.5, 2.0))
     return {"message": "This endpoint is slow"}
 
 @app.get("/error")
-def error_endpoint():
+async def error_endpoint():
     raise ValueError("This is a simulated error")
 
-@app.get("/compute")
-def compute_endpoint(n: int = 10):
-    result = sum(i ** 2 for i in range(n))
+# The result can exceed 64 bits, which orjson cannot encode
+@app.get("/compute", response_class=JSONResponse)
+async def compute_endpoint(n: int = 10):
+    # Closed form of sum(i ** 2 for i in range(n))
+    result = n * (n - 1) * (2 * n - 1) // 6 if n > 0 else 0
     return {"result": result}
 
 @app.get("/server_request")
 async def server_request(request: Request):
-    headers = dict(request.headers)
+    # Decode the raw ASGI header list directly instead of going through Headers,
+    # keeping the first value of a repeated header as dict(request.headers) did
+    headers = {}
+    for k, v in request.scope["headers"]:
+        headers.setdefault(k.decode("latin-1"), v.decode("latin-1"))
     query_params = dict(request.query_params)
-    body = await request.json() if request.method in ["POST", "PUT", "PATCH"] else {}
+    body = await request.json() if request.method in BODY_METHODS else {}
     return {
         "headers": headers,
         "query_params": query_params,
@@ -83,4 +63,12 @@ async def server_request(request: Request):
     }
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "instrumentation.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="auto",
+        http="auto",
+        reload=os.getenv("DEV") == "1",
+    )
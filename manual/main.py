@@ -1,66 +1,38 @@
-import logging
+import asyncio
+import os
 import random
 import time
 
 import uvicorn
-from fastapi import FastAPI, Request
-from opentelemetry import metrics, trace
-from opentelemetry._logs import set_logger_provider
-from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
-from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
-from opentelemetry.sdk._logs._internal.export import BatchLogRecordProcessor
-from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
-from opentelemetry.sdk.resources import SERVICE_NAME, Resource, SERVICE_VERSION
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
 
-resource = Resource(attributes={
-    SERVICE_NAME: "cf-o11y",
-    SERVICE_VERSION: "1.0-BETA"
-})
+from telemetry import export_uvicorn_errors, setup
 
-provider = TracerProvider(resource=resource)
-processor = BatchSpanProcessor(OTLPSpanExporter(endpoint="http://localhost:4318/v1/traces"))
-trace.set_tracer_provider(provider)
-trace.get_tracer_provider().add_span_processor(processor)
+tracer, meter, logger = setup("cf-o11y", "1.0-BETA", "CF-Service")
 
+app = FastAPI(default_response_class=ORJSONResponse)
+export_uvicorn_errors(app)
 
-# Metrics
-reader = PeriodicExportingMetricReader(
-    OTLPMetricExporter(endpoint="http://localhost:4318/v1/metrics")
-)
-metricsProvider = MeterProvider(resource=resource, metric_readers=[reader])
-metrics.set_meter_provider(metricsProvider)
+# HTTP methods whose request body is echoed back by /server_request
+BODY_METHODS = frozenset(("POST", "PUT", "PATCH"))
 
+# Per-worker PRNG for the simulated /slow delay, bound once at import
+slow_delay = random.Random().uniform
 
-# logs
-logger_exporter = OTLPLogExporter(endpoint="http://localhost:4318/v1/logs")
-logger_provider = LoggerProvider(resource=resource)
-logger_provider.add_log_record_processor(BatchLogRecordProcessor(logger_exporter))
-
-handler = LoggingHandler(level=logging.NOTSET, logger_provider=logger_provider)
-
-logging.getLogger().addHandler(handler)
-
-set_logger_provider(logger_provider)
-
-logger = logging.getLogger("CF-Service")
-
-app = FastAPI()
-
-# Tracer and Meter
-tracer = trace.get_tracer(__name__)
-meter = metrics.get_meter(__name__)
+# Pre-serialised /health body, reused for every probe
+HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
 
 # Define counters and histograms for each endpoint
 counters = {}
 histograms = {}
 
+# Histogram bucket boundaries (seconds) matched to each endpoint's latency range
+SLOW_BUCKETS = [0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0, 2.5, 5.0]
+FAST_BUCKETS = [0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1]
+
 # Function to create metrics for an endpoint
-def create_endpoint_metrics(endpoint_name):
+def create_endpoint_metrics(endpoint_name, buckets):
     counters[endpoint_name] = meter.create_counter(
         name=f"{endpoint_name}_requests_total",
         description=f"Total number of requests to the {endpoint_name} endpoint",
@@ -70,77 +42,97 @@ def create_endpoint_metrics(endpoint_name):
         name=f"{endpoint_name}_request_duration_seconds",
         description=f"Duration of {endpoint_name} endpoint requests",
         unit="s",
+        explicit_bucket_boundaries_advisory=buckets,
     )
 
 # Create metrics for each endpoint
-create_endpoint_metrics("slow")
-create_endpoint_metrics("error")
-create_endpoint_metrics("compute")
-create_endpoint_metrics("server_request")
+create_endpoint_metrics("slow", SLOW_BUCKETS)
+create_endpoint_metrics("error", FAST_BUCKETS)
+create_endpoint_metrics("compute", FAST_BUCKETS)
+create_endpoint_metrics("server_request", FAST_BUCKETS)
+
+# Bind instruments to module-level names to skip dict lookups per request
+slow_counter, slow_histogram = counters["slow"], histograms["slow"]
+error_counter, error_histogram = counters["error"], histograms["error"]
+compute_counter, compute_histogram = counters["compute"], histograms["compute"]
+server_request_counter, server_request_histogram = counters["server_request"], histograms["server_request"]
+
+# Set OTEL_METRICS_ENABLED=0 to skip per-request metric recording entirely
+METRICS_ENABLED = os.getenv("OTEL_METRICS_ENABLED", "1") == "1"
 
 @app.get("/health")
-def health_check():
-    return {"status": "ok"}
+async def health_check():
+    return HEALTH_RESPONSE
 
 @app.get("/slow")
-def slow_endpoint():
+async def slow_endpoint():
     with tracer.start_as_current_span("slow_endpoint_span"):
-        counters["slow"].add(1)
-        start_time = time.time()
+        if METRICS_ENABLED:
+            slow_counter.add(1)
+        start_time = time.perf_counter_ns()
 
-        time.sleep(random.uniform(0.5, 2.0))
+        await asyncio.sleep(slow_delay(0.5, 2.0))
 
-        duration = time.time() - start_time
-        histograms["slow"].record(duration)
+        if METRICS_ENABLED:
+            duration = (time.perf_counter_ns() - start_time) / 1e9
+            slow_histogram.record(duration)
 
         logger.info("slow endpoint")
 
         return {"message": "This endpoint is slow"}
 
 @app.get("/error")
-def error_endpoint():
+async def error_endpoint():
     with tracer.start_as_current_span("error_endpoint_span"):
-        counters["error"].add(1)
-        start_time = time.time()
+        if METRICS_ENABLED:
+            error_counter.add(1)
+        start_time = time.perf_counter_ns()
 
         try:
             logger.error("error endpoint")
             raise ValueError("This is a simulated error")
         finally:
-            duration = time.time() - start_time
-            histograms["error"].record(duration)
-            logger.error("error endpoint")
-
-@app.get("/compute")
-def compute_endpoint(n: int = 10):
-    with tracer.start_as_current_span("compute_endpoint_span") as span:
-        counters["compute"].add(1)
-        start_time = time.time()
-
-        result = sum(i ** 2 for i in range(n))
-
-        duration = time.time() - start_time
-        histograms["compute"].record(duration)
-
-        # Optionally, set attributes and events
-        span.set_attribute("parameter.n", n)
-        span.set_attribute("result", result)
-        span.add_event("Completed computation")
-        logger.info("result: " + str(result))
+            if METRICS_ENABLED:
+                duration = (time.perf_counter_ns() - start_time) / 1e9
+                error_histogram.record(duration)
+
+# The result can exceed 64 bits, which orjson cannot encode
+@app.get("/compute", response_class=JSONResponse)
+async def compute_endpoint(n: int = 10):
+    # Pass attributes up front so the span builds its attribute mapping once
+    with tracer.start_as_current_span("compute_endpoint_span", attributes={"parameter.n": n}):
+        if METRICS_ENABLED:
+            compute_counter.add(1)
+        start_time = time.perf_counter_ns()
+
+        # Closed form of sum(i ** 2 for i in range(n))
+        result = n * (n - 1) * (2 * n - 1) // 6 if n > 0 else 0
+
+        if METRICS_ENABLED:
+            duration = (time.perf_counter_ns() - start_time) / 1e9
+            compute_histogram.record(duration)
+
+        logger.info("result: %s", result)
     return {"result": result}
 
 @app.get("/server_request")
 async def server_request(request: Request):
     with tracer.start_as_current_span("server_request_span"):
-        counters["server_request"].add(1)
-        start_time = time.time()
-
-        headers = dict(request.headers)
+        if METRICS_ENABLED:
+            server_request_counter.add(1)
+        start_time = time.perf_counter_ns()
+
+        # Decode the raw ASGI header list directly instead of going through Headers,
+        # keeping the first value of a repeated header as dict(request.headers) did
+        headers = {}
+        for k, v in request.scope["headers"]:
+            headers.setdefault(k.decode("latin-1"), v.decode("latin-1"))
         query_params = dict(request.query_params)
-        body = await request.json() if request.method in ["POST", "PUT", "PATCH"] else {}
+        body = await request.json() if request.method in BODY_METHODS else {}
 
-        duration = time.time() - start_time
-        histograms["server_request"].record(duration)
+        if METRICS_ENABLED:
+            duration = (time.perf_counter_ns() - start_time) / 1e9
+            server_request_histogram.record(duration)
         logger.info("The server requests has been processed successfully")
         return {
             "headers": headers,
@@ -148,5 +140,13 @@ async def server_request(request: Request):
             "body": body
         }
 if __name__ == "__main__":
-    uvicorn.run("manual.main:app", host="0.0.0.0", port=8001, reload=True)
+    uvicorn.run(
+        "manual.main:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="auto",
+        http="auto",
+        reload=os.getenv("DEV") == "1",
+    )
     logger.info("Starting the server on port 8001")
\ No newline at end of file
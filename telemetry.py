@@ -0,0 +1,137 @@
+import logging
+import os
+import uuid
+from functools import lru_cache
+
+from opentelemetry import metrics, trace
+from opentelemetry._logs import set_logger_provider
+from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
+from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+from opentelemetry.sdk.resources import SERVICE_INSTANCE_ID, SERVICE_NAME, Resource, SERVICE_VERSION
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+# OTLP/gRPC by default; set OTEL_EXPORTER_OTLP_PROTOCOL=http/protobuf to use HTTP
+OTLP_PROTOCOL = os.getenv("OTEL_EXPORTER_OTLP_PROTOCOL", "grpc")
+
+if OTLP_PROTOCOL == "grpc":
+    from grpc import Compression
+    from opentelemetry.exporter.otlp.proto.grpc._log_exporter import OTLPLogExporter
+    from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+    OTLP_ENDPOINTS = {
+        "traces": "http://localhost:4317",
+        "metrics": "http://localhost:4317",
+        "logs": "http://localhost:4317",
+    }
+    OTLP_EXPORTER_ARGS = {"insecure": True, "compression": Compression.Gzip}
+else:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from opentelemetry.exporter.otlp.proto.http import Compression
+    from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
+    from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+    OTLP_ENDPOINTS = {
+        "traces": "http://localhost:4318/v1/traces",
+        "metrics": "http://localhost:4318/v1/metrics",
+        "logs": "http://localhost:4318/v1/logs",
+    }
+
+    # One pooled session shared by the trace, metric and log exporters
+    otlp_session = requests.Session()
+    otlp_session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=64))
+    OTLP_EXPORTER_ARGS = {"compression": Compression.Gzip, "session": otlp_session}
+
+# Minimum level of exported log records; WARNING matches the root logger's default
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+
+
+# LoggingHandler bound to the installed LoggerProvider, and the service it was installed
+# for; both are set by the first install_providers call
+log_handler = None
+installed_service = None
+
+
+def install_providers(service_name, service_version):
+    # The global providers can only be set once per interpreter, so later calls
+    # reuse the first ones instead of starting exporter threads that never get used
+    global log_handler, installed_service
+    if log_handler is not None:
+        if installed_service != (service_name, service_version):
+            logging.getLogger(__name__).warning(
+                "OpenTelemetry providers are already installed for %s %s, "
+                "%s %s will export under that resource",
+                *installed_service, service_name, service_version,
+            )
+        return log_handler
+
+    # Each uvicorn worker exports its own cumulative series, so give every process a
+    # distinct instance id to keep them from overwriting each other in Prometheus
+    resource = Resource(attributes={
+        SERVICE_NAME: service_name,
+        SERVICE_VERSION: service_version,
+        SERVICE_INSTANCE_ID: str(uuid.uuid4()),
+    })
+
+    # Traces, head-sampled at 10% of root traces unless OTEL_TRACES_SAMPLER_ARG says otherwise
+    sampler = ParentBased(TraceIdRatioBased(float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "0.1"))))
+    provider = TracerProvider(resource=resource, sampler=sampler)
+    provider.add_span_processor(BatchSpanProcessor(
+        OTLPSpanExporter(endpoint=OTLP_ENDPOINTS["traces"], **OTLP_EXPORTER_ARGS),
+        max_queue_size=int(os.getenv("OTEL_BSP_MAX_QUEUE_SIZE", 4096)),
+        schedule_delay_millis=int(os.getenv("OTEL_BSP_SCHEDULE_DELAY", 1000)),
+        max_export_batch_size=int(os.getenv("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", 256)),
+        export_timeout_millis=int(os.getenv("OTEL_BSP_EXPORT_TIMEOUT", 10000)),
+    ))
+    trace.set_tracer_provider(provider)
+
+    # Metrics
+    reader = PeriodicExportingMetricReader(
+        OTLPMetricExporter(endpoint=OTLP_ENDPOINTS["metrics"], **OTLP_EXPORTER_ARGS)
+    )
+    metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[reader]))
+
+    # Logs
+    logger_provider = LoggerProvider(resource=resource)
+    logger_provider.add_log_record_processor(BatchLogRecordProcessor(
+        OTLPLogExporter(endpoint=OTLP_ENDPOINTS["logs"], **OTLP_EXPORTER_ARGS),
+        max_queue_size=int(os.getenv("OTEL_BLRP_MAX_QUEUE_SIZE", 4096)),
+        schedule_delay_millis=int(os.getenv("OTEL_BLRP_SCHEDULE_DELAY", 1000)),
+        max_export_batch_size=int(os.getenv("OTEL_BLRP_MAX_EXPORT_BATCH_SIZE", 256)),
+        export_timeout_millis=int(os.getenv("OTEL_BLRP_EXPORT_TIMEOUT", 10000)),
+    ))
+    set_logger_provider(logger_provider)
+
+    log_handler = LoggingHandler(level=LOG_LEVEL, logger_provider=logger_provider)
+    installed_service = (service_name, service_version)
+    return log_handler
+
+
+@lru_cache(maxsize=None)
+def setup(service_name, service_version, logger_name):
+    handler = install_providers(service_name, service_version)
+
+    # Only export the service's own records, not every library logging to the root logger
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.setLevel(LOG_LEVEL)
+
+    return trace.get_tracer(logger_name), metrics.get_meter(logger_name), logger
+
+
+def export_uvicorn_errors(app):
+    # uvicorn.error carries unhandled exception tracebacks. uvicorn's dictConfig clears its
+    # handlers after the app module is imported, so attach the OTLP handler on startup
+    def attach_handler():
+        uvicorn_error_logger = logging.getLogger("uvicorn.error")
+        if log_handler is not None and log_handler not in uvicorn_error_logger.handlers:
+            uvicorn_error_logger.addHandler(log_handler)
+
+    app.add_event_handler("startup", attach_handler)